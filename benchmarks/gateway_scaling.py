@@ -0,0 +1,187 @@
+"""
+Calls-per-host benchmark for the gateway / pipeline-worker split.
+
+Streams synthetic calls through the pipeline as fast as it will take them
+and reports capacity as seconds of call audio processed per wall-clock
+second, i.e. the number of real-time calls the host could carry. The
+in-process row is the single-process layout; the other rows shard the same
+calls over 1..N worker processes through WorkerPool.
+
+The synthetic pipeline stands in for the CPU work of a call without any
+API keys: the answering-machine classifier on inbound audio, plus one
+reply frame per inbound frame encoded to μ-law with the per-sample loop
+OpenAITTS uses. Both sides also do the JSON/base64 handling the gateway
+and IPCWebSocket do for real calls.
+
+Usage:
+    python -m benchmarks.gateway_scaling --calls 64 --seconds 10
+"""
+import os
+import json
+import time
+import base64
+import asyncio
+import argparse
+
+from services.gateway import ipc
+from services.gateway.gateway import WorkerPool
+from services.amd.machine_detector import MachineDetector
+
+FRAME_BYTES = 160
+FRAME_SECONDS = 0.02
+SYNTHETIC_FACTORY = "benchmarks.gateway_scaling:SyntheticPipeline"
+
+
+def linear_to_mulaw(linear_sample):
+    '''Same per-sample μ-law encoding as OpenAITTS.linear_to_mulaw'''
+    BIAS = 0x84
+    CLIP = 32635
+
+    if linear_sample < 0:
+        linear_sample = -linear_sample
+        sign = 0x80
+    else:
+        sign = 0x00
+
+    if linear_sample > CLIP:
+        linear_sample = CLIP
+
+    linear_sample += BIAS
+
+    exponent = 7
+    for i in range(7):
+        if linear_sample <= (0x1F << (exponent + 2)):
+            break
+        exponent -= 1
+
+    mantissa = (linear_sample >> (exponent + 3)) & 0x0F
+    return ~(sign | (exponent << 4) | mantissa) & 0xFF
+
+
+REPLY_PCM = [int(8000 * ((i % 40) - 20) / 20) for i in range(FRAME_BYTES)]
+
+
+class SyntheticPipeline:
+    """CPU stand-in for CallPipeline; answers every inbound frame with one reply frame."""
+    def __init__(self, ws):
+        self.ws = ws
+        self.stream_sid = None
+        self.detector = MachineDetector()
+
+    async def start(self, stream_sid: str, call_sid: str):
+        self.stream_sid = stream_sid
+
+    async def media(self, payload_mulaw: bytes):
+        self.detector.feed(payload_mulaw)
+        reply = bytes(linear_to_mulaw(sample) for sample in REPLY_PCM)
+        await self.ws.send_text(json.dumps({
+            'event': 'media',
+            'streamSid': self.stream_sid,
+            'media': {'payload': base64.b64encode(reply).decode('utf-8')}
+        }))
+
+    def amd_result(self, answered_by: str):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class CountingWebSocket:
+    """Outbound side of the in-process layout: parses what a pipeline sends, like the gateway would."""
+    def __init__(self):
+        self.frames = 0
+
+    async def send_text(self, text: str):
+        if json.loads(text).get('event') == 'media':
+            self.frames += 1
+
+
+def twilio_media_messages(stream_sid: str, frames: int):
+    # Alternate speech-level noise and silence so the classifier does real work
+    speech = base64.b64encode(bytes((i * 37) & 0xFF for i in range(FRAME_BYTES))).decode('utf-8')
+    silence = base64.b64encode(b'\xff' * FRAME_BYTES).decode('utf-8')
+    return [
+        json.dumps({'event': 'media', 'streamSid': stream_sid, 'media': {'payload': speech if (i // 50) % 2 == 0 else silence}})
+        for i in range(frames)
+    ]
+
+
+async def run_in_process(calls: int, frames: int) -> float:
+    async def one_call(n):
+        ws = CountingWebSocket()
+        pipeline = SyntheticPipeline(ws)
+        await pipeline.start(f"MZ{n}", f"CA{n}")
+        for message in twilio_media_messages(f"MZ{n}", frames):
+            data = json.loads(message)
+            await pipeline.media(base64.b64decode(data['media']['payload']))
+            # Let other calls interleave, as websocket reads would
+            await asyncio.sleep(0)
+        assert ws.frames == frames
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_call(n) for n in range(calls)))
+    return time.perf_counter() - start
+
+
+async def run_workers(pool: WorkerPool, calls: int, frames: int) -> float:
+    async def one_call(n):
+        call_sid = f"CA{n}"
+        _, reader, writer = await pool.connect(call_sid)
+
+        async def receive():
+            received = 0
+            while received < frames:
+                frame = await ipc.read_frame(reader)
+                if frame is None:
+                    raise RuntimeError(f"Worker closed call {call_sid} early")
+                frame_type, _, payload = frame
+                if frame_type == ipc.MEDIA_OUT:
+                    json.loads(payload)
+                    received += 1
+
+        receiver = asyncio.create_task(receive())
+        await ipc.write_frame(writer, ipc.START, json.dumps({"streamSid": f"MZ{n}", "callSid": call_sid}).encode('utf-8'))
+        for message in twilio_media_messages(f"MZ{n}", frames):
+            data = json.loads(message)
+            await ipc.write_frame(writer, ipc.MEDIA_IN, base64.b64decode(data['media']['payload']))
+        await receiver
+
+        await ipc.write_frame(writer, ipc.STOP)
+        writer.close()
+        pool.release(call_sid)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_call(n) for n in range(calls)))
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=64, help="concurrent calls per run")
+    parser.add_argument("--seconds", type=float, default=10, help="audio seconds per call")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    frames = int(args.seconds / FRAME_SECONDS)
+    audio_seconds = args.calls * frames * FRAME_SECONDS
+    print(f"{args.calls} calls x {args.seconds:g}s audio on {os.cpu_count()} cores\n")
+    print(f"{'layout':<14}{'wall (s)':>10}{'calls/host':>12}{'speedup':>10}")
+
+    elapsed = await run_in_process(args.calls, frames)
+    baseline = audio_seconds / elapsed
+    print(f"{'in-process':<14}{elapsed:>10.2f}{baseline:>12.1f}{1.0:>10.2f}")
+
+    for workers in range(1, args.max_workers + 1):
+        pool = WorkerPool(workers, SYNTHETIC_FACTORY)
+        await pool.start()
+        try:
+            elapsed = await run_workers(pool, args.calls, frames)
+        finally:
+            await pool.stop()
+        capacity = audio_seconds / elapsed
+        print(f"{f'{workers} workers':<14}{elapsed:>10.2f}{capacity:>12.1f}{capacity / baseline:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,14 +1,18 @@
 import os
 import json
+import asyncio
 import base64
 from twilio.rest import Client
+from twilio.request_validator import RequestValidator
 from fastapi import FastAPI, Request, WebSocket, Response, Form
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from services.tts.tts_factory import TTSFactory
-from services.llm.openai_async import LargeLanguageModel
-from services.stt.deepgram import DeepgramTranscriber
+from services.pipeline.call_pipeline import CallPipeline
+from services.gateway.gateway import WorkerPool, GatewayCall
+from services.monitoring.loop_monitor import LoopLagMonitor, LOOP_MONITOR_ENABLED, tag_current_task, call_task_name
+from services.amd.call_screening import CallScreening, AMD_ENABLED, TWILIO_MESSAGE_END_RESULTS
+from services.amd.machine_detector import MACHINE
 
 app = FastAPI()
 
@@ -24,11 +28,45 @@ TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 
 client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+request_validator = RequestValidator(TWILIO_AUTH_TOKEN or '')
+
+# Public host Twilio uses to reach this app
+PUBLIC_HOST = os.getenv('PUBLIC_HOST', 'orca-app-se5sx.ondigitalocean.app')
+
+# Answering-machine screening, only set up when AMD_ENABLED=1
+call_screening = CallScreening(client) if AMD_ENABLED else None
+
+# With PIPELINE_WORKERS=N this process only terminates websockets and paces
+# audio; call pipelines run in N worker processes
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', '0'))
+worker_pool = WorkerPool(PIPELINE_WORKERS, call_screening=call_screening) if PIPELINE_WORKERS > 0 else None
+
+# Event-loop lag monitor for this process; workers run their own
+loop_monitor = LoopLagMonitor()
+
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+
+
+@app.on_event("startup")
+async def start_worker_pool():
+    if worker_pool:
+        await worker_pool.start()
+
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    await loop_monitor.stop()
+
+
+@app.on_event("shutdown")
+async def stop_worker_pool():
+    if worker_pool:
+        await worker_pool.stop()
 
-# Twilio sends audio data as 160 byte messages containing 20ms of audio each
-# We buffer 3 twilio messages corresponding to 60 ms of audio
-BUFFER_SIZE = 3 * 160
-TWILIO_SAMPLE_RATE = 8000
 
 @app.get("/")
 async def get_home(request: Request):
@@ -38,14 +76,31 @@ async def get_home(request: Request):
     })
 
 
+@app.get("/debug/loop")
+async def loop_stats():
+    return loop_monitor.stats()
+
+
 @app.post("/make-call")
 async def make_call(to_number: str = Form(...)):
+    tag_current_task("make-call")
+    call_options = {
+        "from_": TWILIO_PHONE_NUMBER,
+        "to": to_number,
+        "url": f"https://{PUBLIC_HOST}/twiml/instructions",
+        "status_callback": f"https://{PUBLIC_HOST}/twilio/call-status",
+        "status_callback_event": ["initiated", "ringing", "answered", "completed"],
+    }
+    if call_screening:
+        call_options.update({
+            "machine_detection": call_screening.machine_detection,
+            "async_amd": "true",
+            "async_amd_status_callback": f"https://{PUBLIC_HOST}/twilio/amd",
+        })
+
     try:
-        call = client.calls.create(
-            from_=TWILIO_PHONE_NUMBER,
-            to=to_number,
-            url="https://orca-app-se5sx.ondigitalocean.app/twiml/instructions"
-        )
+        # The Twilio client is synchronous; keep the request off the event loop
+        call = await asyncio.to_thread(client.calls.create, **call_options)
 
         return {
             "success": True,
@@ -66,19 +121,85 @@ async def call_instructions():
         content=f'''<?xml version="1.0" encoding="UTF-8"?>
         <Response>
             <Connect>
-                <Stream url="wss://orca-app-se5sx.ondigitalocean.app/twilio"/>
+                <Stream url="wss://{PUBLIC_HOST}/twilio"/>
             </Connect>
         </Response>''',
         media_type="application/xml"
     )
 
 
+async def is_from_twilio(request: Request) -> bool:
+    """Check a webhook's X-Twilio-Signature against the public URL Twilio called."""
+    signature = request.headers.get('X-Twilio-Signature')
+    if not signature or not TWILIO_AUTH_TOKEN:
+        return False
+
+    # Behind the proxy the request arrives over plain http, so rebuild the URL Twilio signed
+    url = f"https://{PUBLIC_HOST}{request.url.path}"
+    if request.url.query:
+        url += f"?{request.url.query}"
+    form = await request.form()
+    return request_validator.validate(url, dict(form), signature)
+
+
+@app.post("/twilio/amd")
+async def amd_result(
+    request: Request,
+    call_sid: str = Form(..., alias="CallSid"),
+    answered_by: str = Form(..., alias="AnsweredBy"),
+):
+    if not await is_from_twilio(request):
+        return Response(status_code=403)
+    if not call_screening:
+        return Response(status_code=204)
+
+    verdict = call_screening.twilio_verdict(call_sid, answered_by)
+    if verdict == MACHINE:
+        # Fax machines and greetings still in progress get a hang-up rather than a message
+        await call_screening.handle_machine(call_sid, "twilio", leave_message=answered_by in TWILIO_MESSAGE_END_RESULTS)
+    if worker_pool:
+        # Lets the worker screening this call's audio stop waiting on its own classifier
+        await worker_pool.relay_amd(call_sid, answered_by)
+    return Response(status_code=204)
+
+
+@app.post("/twilio/call-status")
+async def call_status(
+    request: Request,
+    call_sid: str = Form(..., alias="CallSid"),
+    status: str = Form(..., alias="CallStatus"),
+    duration: str = Form(None, alias="CallDuration"),
+):
+    if not await is_from_twilio(request):
+        return Response(status_code=403)
+    if call_screening:
+        call_screening.call_status(call_sid, status, duration)
+    return Response(status_code=204)
+
+
+@app.get("/debug/amd")
+async def amd_stats():
+    if not call_screening:
+        return {"enabled": False}
+    return call_screening.stats()
+
+
+@app.get("/debug/workers")
+async def worker_stats():
+    if not worker_pool:
+        return {"workers": [], "active_calls": 0}
+    return await worker_pool.stats()
+
+
 @app.websocket("/twilio")
 async def twilio_websocket(websocket: WebSocket):
     await websocket.accept()
-    buffer = bytearray(b'')
-    empty_byte_received = False
-    transcriber = None
+
+    if worker_pool:
+        await GatewayCall(websocket, worker_pool).run()
+        return
+
+    pipeline = CallPipeline(websocket, call_screening)
 
     try:
         async for message in websocket.iter_text():
@@ -87,48 +208,26 @@ async def twilio_websocket(websocket: WebSocket):
             match data['event']:
                 case "start":
                     stream_sid = data['streamSid']
-                    print(f"Call started for stream_sid: {stream_sid}")
-
-                    text_to_speech = TTSFactory.create_tts_provider("elevenlabs", websocket, stream_sid)                    
-                    await text_to_speech.get_audio_from_text(f"Hello, is this James?")
-
-                    openai_llm = LargeLanguageModel(text_to_speech)
-                    openai_llm.init_chat()
-
-                    transcriber = DeepgramTranscriber(openai_llm, websocket, stream_sid)
-                    await transcriber.deepgram_connect()
+                    call_sid = data['start'].get('callSid', stream_sid)
+                    tag_current_task(call_task_name(call_sid))
+                    await pipeline.start(stream_sid, call_sid)
 
                 case "connected":
                     print('Websocket connected')
 
                 case "media":
-                    if transcriber: #and transcriber.is_connected:
-                        # Send audio to Deepgram
-                        payload_b64 = data['media']['payload']
-                        payload_mulaw = base64.b64decode(payload_b64)
-                        buffer.extend(payload_mulaw)
-
-                        if payload_mulaw == b'':
-                            empty_byte_received = True
-
-                        # Send buffer when it reaches the target size or when silence detected
-                        if len(buffer) >= BUFFER_SIZE or empty_byte_received:
-                            await transcriber.dg_connection.send(buffer)
-                            buffer = bytearray(b'')
-                            empty_byte_received = False
+                    payload_b64 = data['media']['payload']
+                    await pipeline.media(base64.b64decode(payload_b64))
                 
                 case "stop":
-                    if transcriber:
-                        await transcriber.deepgram_close()
+                    await pipeline.stop()
                     print("Stop message received")
 
     except Exception as e:
         print(f"Websocket error: {e}")
     finally:
         # Cleanup
-        if transcriber:
-            await transcriber.deepgram_close()
-
+        await pipeline.stop()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,212 @@
+import os
+import time
+import asyncio
+from xml.sax.saxutils import escape
+from twilio.rest import Client
+
+from services.amd.machine_detector import MachineDetector, HUMAN, MACHINE, UNKNOWN
+
+# Answering-machine detection, enabled with AMD_ENABLED=1
+AMD_ENABLED = os.getenv('AMD_ENABLED', '0').lower() in ('1', 'true', 'yes')
+# What to do when a machine answers: "hangup" or "voicemail"
+AMD_POLICY = os.getenv('AMD_POLICY', 'hangup').lower()
+# Pre-rendered voicemail audio, played with <Play>; falls back to <Say> with VOICEMAIL_MESSAGE
+VOICEMAIL_AUDIO_URL = os.getenv('VOICEMAIL_AUDIO_URL')
+VOICEMAIL_MESSAGE = os.getenv('VOICEMAIL_MESSAGE', "Hi, this is a message for James. Please call us back at your convenience. Thank you.")
+
+# Twilio AnsweredBy values that mean no person is on the line
+TWILIO_MACHINE_RESULTS = {"machine_start", "machine_end_beep", "machine_end_silence", "machine_end_other", "fax"}
+# Results sent once the greeting has finished, when a voicemail can be left
+TWILIO_MESSAGE_END_RESULTS = {"machine_end_beep", "machine_end_silence", "machine_end_other"}
+FINAL_CALL_STATUSES = {"completed", "busy", "no-answer", "failed", "canceled"}
+# Give up waiting for a voicemail greeting to end after this long and leave the message anyway
+MAX_GREETING_MS = 30000
+
+
+def answered_by_verdict(answered_by: str) -> str:
+    """Translate a Twilio AnsweredBy value into a verdict."""
+    if answered_by in TWILIO_MACHINE_RESULTS:
+        return MACHINE
+    if answered_by == "human":
+        return HUMAN
+    return UNKNOWN
+
+
+# Where a call is in its lifecycle
+SCREENING = "screening"
+PIPELINE = "pipeline"
+RELEASED = "released"
+
+
+class CallScreening:
+    """
+    Tracks answering-machine verdicts per call and applies the hang-up or
+    voicemail policy, from either Twilio's async AMD callback or the local
+    MachineDetector on the media stream.
+    """
+    def __init__(self, client: Client, policy: str = AMD_POLICY):
+        if policy not in ("hangup", "voicemail"):
+            raise ValueError(f"Unsupported AMD policy: {policy}. Available policies: hangup, voicemail")
+        self.client = client
+        self.policy = policy
+        self.calls = {}
+        self.counters = {
+            "calls_screened": 0,
+            "humans": 0,
+            "machines": 0,
+            "machines_detected_by_twilio": 0,
+            "machines_detected_locally": 0,
+            "unknown": 0,
+            "hangups": 0,
+            "voicemails_dropped": 0,
+            # machine calls stopped before Deepgram, the LLM or TTS were started
+            "pipelines_skipped": 0,
+            # machine calls found after the pipeline was already running
+            "pipelines_torn_down": 0,
+            "machine_slot_seconds": 0.0,
+            "human_call_seconds": 0.0,
+            "human_calls_completed": 0,
+        }
+        self.call_statuses = {}
+
+    @property
+    def machine_detection(self) -> str:
+        """Twilio MachineDetection mode matching the policy."""
+        # Waiting for the end of the greeting is only needed to leave a message
+        return "DetectMessageEnd" if self.policy == "voicemail" else "Enable"
+
+    def call_state(self, call_sid: str) -> dict:
+        if call_sid not in self.calls:
+            self.calls[call_sid] = {"state": SCREENING, "verdict": None, "started": time.monotonic(), "handled": False}
+            self.counters["calls_screened"] += 1
+        return self.calls[call_sid]
+
+    def start_session(self, call_sid: str) -> "ScreeningSession":
+        self.call_state(call_sid)
+        return ScreeningSession(self, call_sid)
+
+    def twilio_verdict(self, call_sid: str, answered_by: str) -> str:
+        """Translate a Twilio AnsweredBy value into a verdict and store it."""
+        verdict = answered_by_verdict(answered_by)
+        call = self.call_state(call_sid)
+        if not call["verdict"] or call["verdict"] == UNKNOWN:
+            call["verdict"] = verdict
+        return verdict
+
+    def pipeline_started(self, call_sid: str):
+        self.call_state(call_sid)["state"] = PIPELINE
+
+    def record_verdict(self, call_sid: str, verdict: str, source: str):
+        call = self.call_state(call_sid)
+        call["verdict"] = verdict
+        print(f"Call {call_sid} answered by {verdict} ({source})")
+        if verdict == HUMAN:
+            self.counters["humans"] += 1
+        elif verdict == UNKNOWN:
+            self.counters["unknown"] += 1
+
+    async def handle_machine(self, call_sid: str, source: str, leave_message: bool = True):
+        """Apply the policy to a call answered by a machine. Runs at most once per call."""
+        call = self.call_state(call_sid)
+        call["verdict"] = MACHINE
+        if call["handled"]:
+            return
+        call["handled"] = True
+
+        self.counters["machines"] += 1
+        self.counters[f"machines_detected_{'by_twilio' if source == 'twilio' else 'locally'}"] += 1
+        self.counters["pipelines_torn_down" if call["state"] == PIPELINE else "pipelines_skipped"] += 1
+        self.counters["machine_slot_seconds"] += time.monotonic() - call["started"]
+        call["state"] = RELEASED
+
+        try:
+            if self.policy == "voicemail" and leave_message:
+                # Replacing the TwiML ends the media stream and plays the message
+                await asyncio.to_thread(self.client.calls(call_sid).update, twiml=self.voicemail_twiml())
+                self.counters["voicemails_dropped"] += 1
+                print(f"Voicemail dropped for call {call_sid} ({source})")
+            else:
+                await asyncio.to_thread(self.client.calls(call_sid).update, status="completed")
+                self.counters["hangups"] += 1
+                print(f"Machine answered call {call_sid}, hung up ({source})")
+        except Exception as e:
+            print(f"Error applying AMD policy to call {call_sid}: {e}")
+
+    def voicemail_twiml(self) -> str:
+        if VOICEMAIL_AUDIO_URL:
+            message = f"<Play>{escape(VOICEMAIL_AUDIO_URL)}</Play>"
+        else:
+            message = f"<Say>{escape(VOICEMAIL_MESSAGE)}</Say>"
+        return f'<?xml version="1.0" encoding="UTF-8"?><Response>{message}<Hangup/></Response>'
+
+    def call_status(self, call_sid: str, status: str, duration: str = None):
+        """Record a Twilio call-status callback and forget finished calls."""
+        self.call_statuses[status] = self.call_statuses.get(status, 0) + 1
+        if status not in FINAL_CALL_STATUSES:
+            return
+
+        call = self.calls.pop(call_sid, None)
+        if call and call["verdict"] != MACHINE and status == "completed" and duration:
+            self.counters["human_calls_completed"] += 1
+            self.counters["human_call_seconds"] += float(duration)
+
+    def stats(self) -> dict:
+        counters = dict(self.counters)
+        human_calls = counters["human_calls_completed"]
+        avg_human = counters["human_call_seconds"] / human_calls if human_calls else 0.0
+        # Slot time a machine call would have held had it been treated like a person
+        reclaimed = max(0.0, counters["machines"] * avg_human - counters["machine_slot_seconds"])
+
+        counters["machine_slot_seconds"] = round(counters["machine_slot_seconds"], 2)
+        return {
+            "policy": self.policy,
+            "counters": counters,
+            "call_statuses": dict(self.call_statuses),
+            "active_calls": len(self.calls),
+            "avg_human_call_seconds": round(avg_human, 2),
+            "estimated_slot_seconds_reclaimed": round(reclaimed, 2),
+        }
+
+
+class ScreeningSession:
+    """
+    Screens the first seconds of one call's inbound audio before the AI
+    pipeline is started.
+    """
+    def __init__(self, screening: CallScreening, call_sid: str):
+        self.screening = screening
+        self.call_sid = call_sid
+        self.detector = MachineDetector()
+        self.verdict = None
+
+    async def feed(self, payload_mulaw: bytes):
+        """
+        Feed inbound audio until the call is classified.
+
+        Returns:
+            HUMAN or UNKNOWN when the pipeline should start, MACHINE once the
+            call has been handed to the policy, otherwise None
+        """
+        if self.verdict:
+            return self.verdict
+
+        call = self.screening.call_state(self.call_sid)
+        # Twilio's async AMD result wins when it arrives first
+        if call["verdict"] in (HUMAN, MACHINE):
+            self.verdict = call["verdict"]
+            if self.verdict == HUMAN:
+                self.screening.record_verdict(self.call_sid, HUMAN, "twilio")
+            return self.verdict
+
+        local = self.detector.feed(payload_mulaw)
+        if local == MACHINE:
+            # Leave the message only once the greeting (and its beep) is over
+            if self.screening.policy == "voicemail" and not self.detector.greeting_ended and self.detector.elapsed_ms < MAX_GREETING_MS:
+                return None
+            self.verdict = MACHINE
+            await self.screening.handle_machine(self.call_sid, "local")
+        elif local in (HUMAN, UNKNOWN):
+            self.verdict = local
+            self.screening.record_verdict(self.call_sid, local, "local")
+
+        return self.verdict
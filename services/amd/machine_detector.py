@@ -0,0 +1,99 @@
+import audioop
+
+# Twilio media frames carry 20ms of 8kHz μ-law audio
+FRAME_MS = 20
+
+HUMAN = "human"
+MACHINE = "machine"
+UNKNOWN = "unknown"
+
+
+class MachineDetector:
+    """
+    Energy-based answering-machine classifier for the first seconds of a call.
+
+    People answer with short phrases ("Hello?... Hello?") and then wait;
+    voicemail greetings keep talking. The detector tracks the length of the
+    current utterance, which pauses of `gap_ms` or more end, and the silence
+    that follows it:
+
+    - one utterance longer than `machine_speech_ms` -> MACHINE
+    - short utterance followed by `human_silence_ms` of silence -> HUMAN
+    - nothing decisive within `max_ms` -> UNKNOWN
+
+    After a MACHINE verdict it keeps listening until the greeting ends, so a
+    voicemail can be dropped after the beep.
+    """
+    def __init__(
+        self,
+        speech_rms: int = 600,
+        machine_speech_ms: int = 2500,
+        human_silence_ms: int = 800,
+        gap_ms: int = 300,
+        greeting_end_silence_ms: int = 1200,
+        max_ms: int = 5000,
+    ):
+        self.speech_rms = speech_rms
+        self.machine_speech_ms = machine_speech_ms
+        self.human_silence_ms = human_silence_ms
+        self.gap_ms = gap_ms
+        self.greeting_end_silence_ms = greeting_end_silence_ms
+        self.max_ms = max_ms
+
+        self.elapsed_ms = 0
+        self.utterance_ms = 0
+        self.silence_run_ms = 0
+        self.heard_speech = False
+        self.verdict = None
+        self.greeting_ended = False
+        self.remainder = b''
+
+    def is_speech(self, frame_mulaw: bytes) -> bool:
+        pcm = audioop.ulaw2lin(frame_mulaw, 2)
+        return audioop.rms(pcm, 2) >= self.speech_rms
+
+    def feed(self, payload_mulaw: bytes):
+        """
+        Feed raw μ-law audio from a Twilio media message.
+
+        Returns:
+            The verdict (HUMAN, MACHINE or UNKNOWN) once one is reached, otherwise None
+        """
+        data = self.remainder + payload_mulaw
+        frame_size = 8 * FRAME_MS
+        whole = len(data) - len(data) % frame_size
+        self.remainder = data[whole:]
+
+        for i in range(0, whole, frame_size):
+            self._feed_frame(data[i:i + frame_size])
+
+        return self.verdict
+
+    def _feed_frame(self, frame: bytes):
+        self.elapsed_ms += FRAME_MS
+
+        if self.is_speech(frame):
+            self.heard_speech = True
+            if self.silence_run_ms >= self.gap_ms:
+                # A real pause starts a new utterance
+                self.utterance_ms = FRAME_MS
+            else:
+                # Short gaps between words count as part of the utterance
+                self.utterance_ms += FRAME_MS + (self.silence_run_ms if self.utterance_ms else 0)
+            self.silence_run_ms = 0
+        else:
+            self.silence_run_ms += FRAME_MS
+
+        if self.verdict == MACHINE:
+            if self.silence_run_ms >= self.greeting_end_silence_ms:
+                self.greeting_ended = True
+            return
+        if self.verdict:
+            return
+
+        if self.utterance_ms >= self.machine_speech_ms:
+            self.verdict = MACHINE
+        elif self.heard_speech and self.silence_run_ms >= self.human_silence_ms:
+            self.verdict = HUMAN
+        elif self.elapsed_ms >= self.max_ms:
+            self.verdict = UNKNOWN
@@ -0,0 +1,371 @@
+import os
+import json
+import time
+import base64
+import asyncio
+import tempfile
+import multiprocessing
+
+from services.gateway import ipc
+from services.gateway.worker import run_worker, DEFAULT_PIPELINE_FACTORY
+from services.monitoring.loop_monitor import tag_current_task, call_task_name
+
+TWILIO_SAMPLE_RATE = 8000
+# How far ahead of real time outbound audio may be sent to Twilio, in seconds
+AUDIO_LEAD = float(os.getenv('GATEWAY_AUDIO_LEAD', '0.2'))
+WORKER_START_TIMEOUT = 30
+# How often the pool checks for dead workers, in seconds
+SUPERVISE_INTERVAL = 1.0
+# A worker that dies sooner than this after starting counts as a failed start
+RESTART_STABLE_AFTER = 30.0
+# Longest wait between restarts of a worker that keeps failing, in seconds
+RESTART_BACKOFF_MAX = 60.0
+# A worker whose event loop is blocked may not answer a stats request at all
+STATS_TIMEOUT = 1.0
+
+
+class WorkerPool:
+    """
+    Spawns pipeline worker processes, each listening on its own Unix socket,
+    and assigns calls to the live worker with the fewest active calls. Dead
+    workers are respawned in the background.
+    """
+    def __init__(self, num_workers: int, factory_path: str = DEFAULT_PIPELINE_FACTORY, call_screening=None):
+        if num_workers < 1:
+            raise ValueError(f"Worker pool needs at least one worker, got {num_workers}")
+        self.num_workers = num_workers
+        self.factory_path = factory_path
+        # Applies the AMD policy for verdicts the workers report
+        self.call_screening = call_screening
+        self.socket_dir = None
+        self.socket_paths = []
+        self.processes = []
+        self.active = [0] * num_workers
+        self.assigned_total = [0] * num_workers
+        self.restarts = [0] * num_workers
+        # Failed starts in a row, per worker; each one doubles the wait before the next attempt
+        self.failures = [0] * num_workers
+        self.started_at = [0.0] * num_workers
+        # Workers being respawned; not assigned calls until they listen again
+        self.restarting = set()
+        self.restart_tasks = set()
+        self.supervisor = None
+        # call SID -> worker index
+        self.assignments = {}
+        # call SID -> GatewayCall, for relaying webhooks to the owning worker
+        self.calls = {}
+
+    async def start(self):
+        self.socket_dir = tempfile.mkdtemp(prefix="outbound-workers-")
+        self.socket_paths = [os.path.join(self.socket_dir, f"worker-{i}.sock") for i in range(self.num_workers)]
+        self.processes = [None] * self.num_workers
+
+        for i in range(self.num_workers):
+            self._spawn(i)
+        await self._wait_ready(range(self.num_workers))
+
+        self.supervisor = asyncio.create_task(self._supervise())
+        print(f"Started {self.num_workers} pipeline workers in {self.socket_dir}")
+
+    def _spawn(self, i: int):
+        path = self.socket_paths[i]
+        # A dead worker leaves its socket file behind; readiness is judged by the file appearing
+        if os.path.exists(path):
+            os.unlink(path)
+        # Spawn rather than fork: the parent already runs an event loop and client threads
+        context = multiprocessing.get_context("spawn")
+        process = context.Process(target=run_worker, args=(path, self.factory_path), name=f"pipeline-worker-{i}", daemon=True)
+        process.start()
+        self.processes[i] = process
+        self.started_at[i] = time.monotonic()
+
+    async def _wait_ready(self, indices):
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while not all(os.path.exists(self.socket_paths[i]) for i in indices):
+            if not all(self.processes[i].is_alive() for i in indices):
+                raise RuntimeError("A pipeline worker exited during startup")
+            if time.monotonic() > deadline:
+                raise RuntimeError("Pipeline workers did not start in time")
+            await asyncio.sleep(0.05)
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            for i, process in enumerate(self.processes):
+                if process.is_alive() or i in self.restarting:
+                    continue
+                self.restarting.add(i)
+                task = asyncio.create_task(self._restart(i))
+                self.restart_tasks.add(task)
+                task.add_done_callback(self.restart_tasks.discard)
+
+    async def _restart(self, i: int):
+        exit_code = self.processes[i].exitcode
+        # A worker that dies right after starting (bad config, crash on import) would otherwise respawn in a tight loop
+        if time.monotonic() - self.started_at[i] < RESTART_STABLE_AFTER:
+            self.failures[i] += 1
+        else:
+            self.failures[i] = 0
+        delay = min(RESTART_BACKOFF_MAX, SUPERVISE_INTERVAL * 2 ** min(self.failures[i], 16)) if self.failures[i] else 0
+        print(f"Pipeline worker {i} exited with code {exit_code}, restarting in {delay:.1f}s")
+        try:
+            await asyncio.sleep(delay)
+            self._spawn(i)
+            await self._wait_ready([i])
+            self.restarts[i] += 1
+        except Exception as e:
+            # Make sure a worker that never started listening is seen as dead; the supervisor tries again
+            self.processes[i].terminate()
+            print(f"Error restarting pipeline worker {i}: {e}")
+        finally:
+            self.restarting.discard(i)
+
+    def available(self, i: int) -> bool:
+        return i not in self.restarting and self.processes[i].is_alive()
+
+    async def stop(self):
+        # Stop supervising first so nothing respawns the workers being shut down
+        pending = list(self.restart_tasks)
+        if self.supervisor:
+            pending.append(self.supervisor)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            await asyncio.to_thread(process.join, 5)
+        for path in self.socket_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+        if self.socket_dir and os.path.isdir(self.socket_dir):
+            os.rmdir(self.socket_dir)
+
+    def assign(self, call_sid: str, exclude=()) -> int:
+        candidates = [i for i in range(self.num_workers) if i not in exclude and self.available(i)]
+        if not candidates:
+            raise RuntimeError("No pipeline workers available")
+        worker = min(candidates, key=lambda i: (self.active[i], i))
+        self.active[worker] += 1
+        self.assigned_total[worker] += 1
+        self.assignments[call_sid] = worker
+        return worker
+
+    def release(self, call_sid: str):
+        worker = self.assignments.pop(call_sid, None)
+        if worker is not None:
+            self.active[worker] -= 1
+        self.calls.pop(call_sid, None)
+
+    async def connect(self, call_sid: str):
+        """Connect a call to a worker, failing over to the others if one refuses."""
+        tried = set()
+        while True:
+            worker = self.assign(call_sid, exclude=tried)
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_paths[worker])
+                return worker, reader, writer
+            except OSError as e:
+                print(f"Pipeline worker {worker} refused call {call_sid}: {e}")
+                self.release(call_sid)
+                tried.add(worker)
+
+    async def relay_amd(self, call_sid: str, answered_by: str):
+        call = self.calls.get(call_sid)
+        if not call:
+            return
+        try:
+            await call.send(ipc.AMD, answered_by.encode('utf-8'))
+        except Exception as e:
+            print(f"Error relaying AMD result for call {call_sid}: {e}")
+
+    async def worker_stats(self, i: int):
+        """Ask a worker for its own stats, including its event-loop lag monitor."""
+        if not self.available(i):
+            return None
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.socket_paths[i]), STATS_TIMEOUT)
+            await ipc.write_frame(writer, ipc.STATS_REQUEST)
+            frame = await asyncio.wait_for(ipc.read_frame(reader), STATS_TIMEOUT)
+        except asyncio.TimeoutError:
+            return {"error": "timed out"}
+        except OSError as e:
+            return {"error": str(e)}
+        finally:
+            if writer:
+                writer.close()
+        return json.loads(frame[2]) if frame else None
+
+    async def stats(self) -> dict:
+        reported = await asyncio.gather(*(self.worker_stats(i) for i in range(self.num_workers)))
+        return {
+            "workers": [
+                {
+                    "index": i,
+                    "pid": process.pid,
+                    "alive": process.is_alive(),
+                    "restarting": i in self.restarting,
+                    "restarts": self.restarts[i],
+                    "failed_starts": self.failures[i],
+                    "active_calls": self.active[i],
+                    "assigned_total": self.assigned_total[i],
+                    "loop": (reported[i] or {}).get("loop"),
+                    "error": (reported[i] or {}).get("error"),
+                }
+                for i, process in enumerate(self.processes)
+            ],
+            "active_calls": len(self.assignments),
+        }
+
+
+class GatewayCall:
+    """
+    Gateway side of one call: turns Twilio websocket messages into IPC frames
+    for the assigned worker, and paces the worker's audio back out to Twilio.
+    """
+    def __init__(self, ws, pool: WorkerPool):
+        self.ws = ws
+        self.pool = pool
+        self.call_sid = None
+        self.writer = None
+        self.outbound = asyncio.Queue()
+        # Bumped on "clear" so audio queued before it is dropped
+        self.generation = 0
+        self.playhead = 0.0
+        # Twilio reader, worker reader and pacer; the call ends when any of them stops
+        self.tasks = {}
+        self.finished = asyncio.Event()
+
+    async def send(self, frame_type: int, payload: bytes = b''):
+        if self.writer:
+            await ipc.write_frame(self.writer, frame_type, payload)
+
+    async def on_start(self, stream_sid: str, call_sid: str):
+        self.call_sid = call_sid
+        tag_current_task(call_task_name(call_sid))
+        worker, reader, self.writer = await self.pool.connect(call_sid)
+        self.pool.calls[call_sid] = self
+        start = {"streamSid": stream_sid, "callSid": call_sid}
+        if self.pool.call_screening:
+            # Start the clock for machine slot time when the call starts, not at the verdict.
+            # Twilio's AMD result can arrive before the stream starts; the worker needs it too.
+            start["verdict"] = self.pool.call_screening.call_state(call_sid)["verdict"]
+        print(f"Call {call_sid} assigned to pipeline worker {worker}")
+
+        self._run_task("worker", self._read_worker(reader))
+        self._run_task("pacer", self._pace_audio())
+        await self.send(ipc.START, json.dumps(start).encode('utf-8'))
+
+    async def on_media(self, payload_b64: str):
+        await self.send(ipc.MEDIA_IN, base64.b64decode(payload_b64))
+
+    def _run_task(self, name: str, coro):
+        task = asyncio.create_task(coro)
+        task.add_done_callback(lambda _: self.finished.set())
+        self.tasks[name] = task
+
+    async def close(self):
+        twilio_ended = self.tasks["twilio"].done() if "twilio" in self.tasks else True
+        try:
+            await self.send(ipc.STOP)
+        except Exception:
+            pass
+
+        for task in self.tasks.values():
+            task.cancel()
+        results = await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        for name, result in zip(self.tasks, results):
+            if isinstance(result, Exception):
+                print(f"Call {self.call_sid} {name} task failed: {result}")
+
+        if self.writer:
+            self.writer.close()
+        if self.call_sid:
+            self.pool.release(self.call_sid)
+        if not twilio_ended:
+            # Our side failed first; closing the stream ends the call rather than leaving it silent
+            try:
+                await self.ws.close()
+            except Exception:
+                pass
+
+    async def _read_worker(self, reader: asyncio.StreamReader):
+        while True:
+            frame = await ipc.read_frame(reader)
+            if frame is None:
+                print(f"Pipeline worker closed call {self.call_sid}")
+                break
+            frame_type, aux, payload = frame
+
+            if frame_type == ipc.MEDIA_OUT:
+                self.outbound.put_nowait((self.generation, payload.decode('utf-8'), aux))
+            elif frame_type == ipc.CONTROL:
+                if aux:
+                    self._drop_queued_audio()
+                await self.ws.send_text(payload.decode('utf-8'))
+            elif frame_type == ipc.SCREENING:
+                await self._on_screening(json.loads(payload))
+
+    async def _on_screening(self, event: dict):
+        screening = self.pool.call_screening
+        if not screening:
+            return
+
+        match event['event']:
+            case "verdict":
+                screening.record_verdict(self.call_sid, event['verdict'], event['source'])
+            case "pipeline_started":
+                screening.pipeline_started(self.call_sid)
+            case "machine":
+                await screening.handle_machine(self.call_sid, event['source'], leave_message=event['leave_message'])
+
+    def _drop_queued_audio(self):
+        self.generation += 1
+        self.playhead = time.monotonic()
+        while not self.outbound.empty():
+            self.outbound.get_nowait()
+
+    async def _pace_audio(self):
+        """Send audio no more than AUDIO_LEAD seconds ahead of what Twilio is playing."""
+        while True:
+            generation, text, audio_bytes = await self.outbound.get()
+
+            now = time.monotonic()
+            self.playhead = max(self.playhead, now)
+            ahead = self.playhead - now
+            if ahead > AUDIO_LEAD:
+                await asyncio.sleep(ahead - AUDIO_LEAD)
+            if generation != self.generation:
+                continue
+
+            await self.ws.send_text(text)
+            self.playhead += audio_bytes / TWILIO_SAMPLE_RATE
+
+    async def _read_twilio(self):
+        async for message in self.ws.iter_text():
+            data = json.loads(message)
+
+            match data['event']:
+                case "start":
+                    stream_sid = data['streamSid']
+                    await self.on_start(stream_sid, data['start'].get('callSid', stream_sid))
+
+                case "connected":
+                    print('Websocket connected')
+
+                case "media":
+                    await self.on_media(data['media']['payload'])
+
+                case "stop":
+                    print("Stop message received")
+                    break
+
+    async def run(self):
+        """Serve the Twilio websocket until the call ends."""
+        self._run_task("twilio", self._read_twilio())
+        try:
+            await self.finished.wait()
+        finally:
+            await self.close()
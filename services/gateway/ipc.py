@@ -0,0 +1,44 @@
+import struct
+import asyncio
+
+# Frame header: type (1 byte), aux (4 bytes), payload length (4 bytes)
+HEADER = struct.Struct(">BII")
+
+# Gateway -> worker
+START = 0x01      # payload: JSON {"streamSid", "callSid", "verdict"}, verdict: AMD verdict known so far
+MEDIA_IN = 0x02   # payload: raw μ-law audio from Twilio
+STOP = 0x03
+AMD = 0x04        # payload: Twilio AnsweredBy value
+STATS_REQUEST = 0x05  # first frame of a stats connection instead of START
+
+# Worker -> gateway
+MEDIA_OUT = 0x10  # payload: Twilio media message text, aux: number of audio bytes it carries
+CONTROL = 0x11    # payload: any other Twilio message text, aux: 1 to drop queued audio first
+SCREENING = 0x12  # payload: JSON answering-machine event for the gateway's CallScreening
+STATS = 0x13      # payload: JSON worker stats, in reply to STATS_REQUEST
+
+
+def encode_frame(frame_type: int, payload: bytes = b'', aux: int = 0) -> bytes:
+    return HEADER.pack(frame_type, aux, len(payload)) + payload
+
+
+async def write_frame(writer: asyncio.StreamWriter, frame_type: int, payload: bytes = b'', aux: int = 0):
+    # A single write keeps frames from concurrent senders from interleaving
+    writer.write(encode_frame(frame_type, payload, aux))
+    await writer.drain()
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """
+    Read one frame.
+
+    Returns:
+        (frame_type, aux, payload), or None when the other side closed the connection
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+        frame_type, aux, length = HEADER.unpack(header)
+        payload = await reader.readexactly(length) if length else b''
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        return None
+    return frame_type, aux, payload
@@ -0,0 +1,168 @@
+import os
+import json
+import asyncio
+import importlib
+
+from services.gateway import ipc
+from services.amd.call_screening import ScreeningSession, answered_by_verdict, AMD_ENABLED, AMD_POLICY
+from services.amd.machine_detector import MACHINE, UNKNOWN
+from services.monitoring.loop_monitor import LoopLagMonitor, LOOP_MONITOR_ENABLED, tag_current_task, call_task_name
+
+DEFAULT_PIPELINE_FACTORY = "services.gateway.worker:create_call_pipeline"
+
+
+class IPCWebSocket:
+    """
+    Stands in for the Twilio websocket inside a worker process. Pipelines
+    call `send_text` exactly as they would on the real websocket; messages
+    are relayed to the gateway, which paces audio out to Twilio.
+    """
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+
+    async def send_text(self, text: str):
+        message = json.loads(text)
+        payload = text.encode('utf-8')
+
+        if message.get('event') == 'media':
+            # Base64 carries 3 bytes of audio per 4 characters
+            audio_bytes = len(message['media']['payload']) * 3 // 4
+            await ipc.write_frame(self.writer, ipc.MEDIA_OUT, payload, aux=audio_bytes)
+        else:
+            flush = 1 if message.get('event') == 'clear' else 0
+            await ipc.write_frame(self.writer, ipc.CONTROL, payload, aux=flush)
+
+
+class RemoteScreening:
+    """
+    Worker-side stand-in for CallScreening, one per call. The gateway owns
+    answering-machine decisions: verdicts reached on the worker are sent up
+    over IPC, where the policy is applied and counted once per call.
+    """
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.policy = AMD_POLICY
+        self.call = {"verdict": None}
+
+    def _report(self, event: dict):
+        self.writer.write(ipc.encode_frame(ipc.SCREENING, json.dumps(event).encode('utf-8')))
+
+    def call_state(self, call_sid: str) -> dict:
+        return self.call
+
+    def start_session(self, call_sid: str):
+        return ScreeningSession(self, call_sid)
+
+    def seed_verdict(self, verdict: str):
+        """Take the verdict the gateway had before this worker got the call."""
+        if verdict and not self.call["verdict"]:
+            self.call["verdict"] = verdict
+
+    def twilio_verdict(self, call_sid: str, answered_by: str) -> str:
+        verdict = answered_by_verdict(answered_by)
+        if not self.call["verdict"] or self.call["verdict"] == UNKNOWN:
+            self.call["verdict"] = verdict
+        return verdict
+
+    def pipeline_started(self, call_sid: str):
+        self._report({"event": "pipeline_started"})
+
+    def record_verdict(self, call_sid: str, verdict: str, source: str):
+        self.call["verdict"] = verdict
+        self._report({"event": "verdict", "verdict": verdict, "source": source})
+
+    async def handle_machine(self, call_sid: str, source: str, leave_message: bool = True):
+        self.call["verdict"] = MACHINE
+        self._report({"event": "machine", "source": source, "leave_message": leave_message})
+        await self.writer.drain()
+
+
+def create_call_pipeline(ws: IPCWebSocket):
+    """Default pipeline factory: the same pipeline the app runs in-process."""
+    # Imported here so workers running other factories skip the STT/LLM/TTS SDKs
+    from services.pipeline.call_pipeline import CallPipeline
+
+    return CallPipeline(ws, RemoteScreening(ws.writer) if AMD_ENABLED else None)
+
+
+def load_factory(path: str):
+    """Import a pipeline factory given as "module:attribute"."""
+    module_name, _, attr = path.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, pipeline_factory, monitor: LoopLagMonitor):
+    """The gateway opens a connection per call, and one per stats request."""
+    frame = await ipc.read_frame(reader)
+    if frame is None:
+        writer.close()
+        return
+
+    if frame[0] == ipc.STATS_REQUEST:
+        stats = {"pid": os.getpid(), "loop": monitor.stats()}
+        try:
+            await ipc.write_frame(writer, ipc.STATS, json.dumps(stats).encode('utf-8'))
+        finally:
+            writer.close()
+        return
+
+    await handle_call(reader, writer, pipeline_factory, frame)
+
+
+async def handle_call(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, pipeline_factory, frame):
+    """Serve one call, starting from its first frame."""
+    pipeline = pipeline_factory(IPCWebSocket(writer))
+
+    try:
+        while frame is not None:
+            frame_type, _, payload = frame
+
+            match frame_type:
+                case ipc.START:
+                    start = json.loads(payload)
+                    tag_current_task(call_task_name(start['callSid']))
+                    screening = getattr(pipeline, 'call_screening', None)
+                    if isinstance(screening, RemoteScreening):
+                        screening.seed_verdict(start.get('verdict'))
+                    await pipeline.start(start['streamSid'], start['callSid'])
+
+                case ipc.MEDIA_IN:
+                    await pipeline.media(payload)
+
+                case ipc.AMD:
+                    pipeline.amd_result(payload.decode('utf-8'))
+
+                case ipc.STOP:
+                    break
+
+            frame = await ipc.read_frame(reader)
+
+    except Exception as e:
+        print(f"Worker call error: {e}")
+    finally:
+        await pipeline.stop()
+        writer.close()
+
+
+async def serve(socket_path: str, factory_path: str):
+    pipeline_factory = load_factory(factory_path)
+    # The pipelines' blocking STT/LLM/TTS work runs here, so this is where lag needs measuring
+    monitor = LoopLagMonitor()
+    if LOOP_MONITOR_ENABLED:
+        monitor.start()
+
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: handle_connection(reader, writer, pipeline_factory, monitor),
+        path=socket_path,
+    )
+    print(f"Pipeline worker {os.getpid()} listening on {socket_path}")
+    async with server:
+        await server.serve_forever()
+
+
+def run_worker(socket_path: str, factory_path: str = DEFAULT_PIPELINE_FACTORY):
+    """Entry point of a worker process."""
+    try:
+        asyncio.run(serve(socket_path, factory_path))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,234 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import weakref
+import traceback
+import contextvars
+from collections import deque, defaultdict
+
+# Event-loop lag monitor, enabled with LOOP_MONITOR_ENABLED=1
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "0").lower() in ("1", "true", "yes")
+# Interval between heartbeats on the event loop, in seconds
+HEARTBEAT_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.05"))
+# A heartbeat arriving this late (seconds) counts as a blocked loop
+SLOW_THRESHOLD = float(os.getenv("LOOP_MONITOR_THRESHOLD", "0.1"))
+# Number of lag samples kept for the percentile window
+WINDOW_SIZE = 2048
+STACK_DEPTH = 12
+
+
+def call_task_name(call_sid: str) -> str:
+    """Name used for tasks that serve a call, so stalls can be attributed to it."""
+    return f"call:{call_sid}"
+
+
+# Call the running code belongs to; tasks created while it is set inherit it
+current_call = contextvars.ContextVar("current_call", default=None)
+
+
+def tag_current_task(name: str):
+    """
+    Report stalls from the running task, and from every task it creates
+    from now on, under `name`.
+    """
+    current_call.set(name)
+    task = asyncio.current_task()
+    if task:
+        task.set_name(name)
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag and attributes blocking callbacks to the task
+    that was running when the loop stalled.
+
+    A heartbeat coroutine sleeps for a fixed interval and records how late it
+    wakes up. A watchdog thread checks the heartbeat; when it is overdue it
+    samples the loop thread's stack once per stall, so the cost in the
+    steady state is one timer on the loop and one sleeping thread.
+    """
+    def __init__(self, interval: float = HEARTBEAT_INTERVAL, threshold: float = SLOW_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=WINDOW_SIZE)
+        self.offenders = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "stack": []})
+        self.stall_count = 0
+        self.loop = None
+        self.loop_thread_id = None
+        self.last_beat = None
+        self.heartbeat_task = None
+        self.watchdog = None
+        self.running = False
+        self.lock = threading.Lock()
+        # Set by the watchdog when it catches the loop mid-stall
+        self.pending_sample = None
+        self.previous_task_factory = None
+        # task -> call it was created for, on Pythons whose tasks do not expose their context
+        self.task_calls = weakref.WeakKeyDictionary()
+        self.factory_installed = False
+
+    def start(self):
+        """Start monitoring the running event loop."""
+        if self.running:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.running = True
+        self._install_task_factory()
+        self.heartbeat_task = self.loop.create_task(self._heartbeat(), name="loop-lag-monitor")
+        self.watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self.watchdog.start()
+        print(f"Loop lag monitor started (interval={self.interval * 1000:.0f}ms, threshold={self.threshold * 1000:.0f}ms)")
+
+    async def stop(self):
+        """Stop the heartbeat and the watchdog thread."""
+        self.running = False
+        if self.factory_installed:
+            self.loop.set_task_factory(self.previous_task_factory)
+            self.factory_installed = False
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+        if self.watchdog:
+            self.watchdog.join(timeout=self.interval * 4)
+
+    def _install_task_factory(self):
+        """
+        Remember which call each new task was created for. Per-call work often
+        runs in tasks the call did not create itself (SDK listeners, relay
+        loops), and only the task is visible from the watchdog thread.
+
+        Python 3.12+ tasks expose their context, which already carries
+        current_call, so no factory is needed there. That matters: 3.13
+        renames every task made by a custom factory to "None".
+        """
+        if hasattr(asyncio.Task, "get_context"):
+            return
+
+        previous = self.previous_task_factory = self.loop.get_task_factory()
+
+        # Newer Pythons pass name= and eager_start= through to the factory as well as context=
+        def factory(loop, coro, **kwargs):
+            if previous:
+                task = previous(loop, coro, **kwargs)
+            else:
+                task = asyncio.Task(coro, loop=loop, **kwargs)
+            context = kwargs.get("context")
+            call = context.get(current_call) if context is not None else current_call.get()
+            if call:
+                with self.lock:
+                    self.task_calls[task] = call
+            return task
+
+        self.loop.set_task_factory(factory)
+        self.factory_installed = True
+
+    async def _heartbeat(self):
+        while self.running:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.last_beat = now
+
+            with self.lock:
+                self.lags.append(lag)
+                sample = self.pending_sample
+                self.pending_sample = None
+
+            if lag >= self.threshold:
+                self._record_stall(lag, sample)
+
+    def _watch(self):
+        """Runs in a separate thread; samples the loop thread while it is blocked."""
+        sampled_beat = None
+        while self.running:
+            time.sleep(self.interval)
+            beat = self.last_beat
+            overdue = time.monotonic() - beat - self.interval
+            if overdue < self.threshold or beat == sampled_beat:
+                continue
+
+            # One sample per stall: the heartbeat has not advanced since we last looked
+            sampled_beat = beat
+            sample = self._sample_loop_thread()
+            with self.lock:
+                self.pending_sample = sample
+
+    def _sample_loop_thread(self):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = traceback.format_stack(frame, limit=STACK_DEPTH) if frame else []
+
+        task_name = None
+        try:
+            task = asyncio.current_task(self.loop)
+            if task:
+                if hasattr(task, "get_context"):
+                    task_name = task.get_context().get(current_call)
+                else:
+                    with self.lock:
+                        task_name = self.task_calls.get(task)
+                task_name = task_name or task.get_name()
+        except RuntimeError:
+            pass
+
+        return {"task": task_name, "stack": [line.rstrip() for line in stack]}
+
+    def _record_stall(self, lag: float, sample):
+        owner = (sample or {}).get("task") or "unknown"
+        lag_ms = lag * 1000
+
+        with self.lock:
+            self.stall_count += 1
+            entry = self.offenders[owner]
+            entry["count"] += 1
+            entry["total_ms"] += lag_ms
+            if lag_ms >= entry["max_ms"]:
+                entry["max_ms"] = lag_ms
+                if sample and sample["stack"]:
+                    entry["stack"] = sample["stack"]
+
+        print(f"Event loop blocked for {lag_ms:.1f}ms (task: {owner})")
+
+    def percentiles(self) -> dict:
+        with self.lock:
+            lags = sorted(self.lags)
+        if not lags:
+            return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+
+        def pick(q):
+            return round(lags[min(len(lags) - 1, int(q * len(lags)))] * 1000, 2)
+
+        return {"p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": round(lags[-1] * 1000, 2)}
+
+    def top_offenders(self, limit: int = 10) -> list:
+        with self.lock:
+            items = [(name, dict(entry)) for name, entry in self.offenders.items()]
+        items.sort(key=lambda item: item[1]["total_ms"], reverse=True)
+        return [
+            {
+                "task": name,
+                "count": entry["count"],
+                "total_ms": round(entry["total_ms"], 2),
+                "max_ms": round(entry["max_ms"], 2),
+                "stack": entry["stack"],
+            }
+            for name, entry in items[:limit]
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.running,
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "samples": len(self.lags),
+            "stalls": self.stall_count,
+            "lag_ms": self.percentiles(),
+            "top_offenders": self.top_offenders(),
+        }
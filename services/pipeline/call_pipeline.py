@@ -0,0 +1,81 @@
+from fastapi import WebSocket
+
+from services.tts.tts_factory import TTSFactory
+from services.llm.openai_async import LargeLanguageModel
+from services.stt.deepgram import DeepgramTranscriber
+from services.amd.call_screening import CallScreening
+from services.amd.machine_detector import MACHINE
+
+# Twilio sends audio data as 160 byte messages containing 20ms of audio each
+# We buffer 3 twilio messages corresponding to 60 ms of audio
+BUFFER_SIZE = 3 * 160
+
+
+class CallPipeline:
+    """
+    STT -> LLM -> TTS pipeline for a single call.
+
+    The websocket only needs `send_text`, so the pipeline runs the same way
+    behind the Twilio websocket in-process or behind an IPC connection in a
+    worker process.
+    """
+    def __init__(self, ws: WebSocket, screening: CallScreening = None):
+        self.ws = ws
+        self.call_screening = screening
+        self.session = None
+        self.transcriber = None
+        self.stream_sid = None
+        self.call_sid = None
+        self.buffer = bytearray(b'')
+        self.empty_byte_received = False
+
+    async def start(self, stream_sid: str, call_sid: str):
+        self.stream_sid = stream_sid
+        self.call_sid = call_sid
+        print(f"Call started for stream_sid: {stream_sid}")
+
+        if self.call_screening:
+            # Hold off on STT/LLM/TTS until we know a person answered
+            self.session = self.call_screening.start_session(call_sid)
+        else:
+            await self.start_conversation()
+
+    async def start_conversation(self):
+        text_to_speech = TTSFactory.create_tts_provider("elevenlabs", self.ws, self.stream_sid)
+        await text_to_speech.get_audio_from_text(f"Hello, is this James?")
+
+        openai_llm = LargeLanguageModel(text_to_speech)
+        openai_llm.init_chat()
+
+        self.transcriber = DeepgramTranscriber(openai_llm, self.ws, self.stream_sid)
+        await self.transcriber.deepgram_connect()
+
+    async def media(self, payload_mulaw: bytes):
+        if self.session and not self.session.verdict:
+            verdict = await self.session.feed(payload_mulaw)
+            # Audio heard while screening is the callee's greeting, which ours answers
+            if verdict and verdict != MACHINE:
+                self.call_screening.pipeline_started(self.call_sid)
+                await self.start_conversation()
+
+        elif self.transcriber: #and transcriber.is_connected:
+            # Send audio to Deepgram
+            self.buffer.extend(payload_mulaw)
+
+            if payload_mulaw == b'':
+                self.empty_byte_received = True
+
+            # Send buffer when it reaches the target size or when silence detected
+            if len(self.buffer) >= BUFFER_SIZE or self.empty_byte_received:
+                await self.transcriber.dg_connection.send(self.buffer)
+                self.buffer = bytearray(b'')
+                self.empty_byte_received = False
+
+    def amd_result(self, answered_by: str):
+        """Record a Twilio AMD result relayed from the process that received the webhook."""
+        if self.call_screening and self.call_sid:
+            self.call_screening.twilio_verdict(self.call_sid, answered_by)
+
+    async def stop(self):
+        if self.transcriber:
+            await self.transcriber.deepgram_close()
@@ -0,0 +1,72 @@
+import time
+import asyncio
+
+from services.monitoring.loop_monitor import LoopLagMonitor, tag_current_task, call_task_name
+
+
+async def block(seconds: float):
+    time.sleep(seconds)
+    await asyncio.sleep(0.1)
+
+
+async def monitor_while(call):
+    monitor = LoopLagMonitor(interval=0.02, threshold=0.1)
+    monitor.start()
+    try:
+        # Let the heartbeat start before anything blocks the loop
+        await asyncio.sleep(0.05)
+        await asyncio.create_task(call())
+        await asyncio.sleep(0.1)
+    finally:
+        await monitor.stop()
+    return monitor
+
+
+def test_stall_in_tagged_task_is_attributed_to_call():
+    async def call():
+        tag_current_task(call_task_name("CA1"))
+        await block(0.3)
+
+    monitor = asyncio.run(monitor_while(call))
+    assert monitor.top_offenders()[0]["task"] == call_task_name("CA1")
+
+
+def test_stall_in_child_task_is_attributed_to_call():
+    async def call():
+        tag_current_task(call_task_name("CA1"))
+        await asyncio.create_task(block(0.3))
+
+    monitor = asyncio.run(monitor_while(call))
+    offenders = monitor.top_offenders()
+    assert offenders[0]["task"] == call_task_name("CA1")
+    assert offenders[0]["count"] == 1
+
+
+def test_untagged_tasks_keep_their_names():
+    async def main():
+        monitor = LoopLagMonitor(interval=0.02, threshold=0.1)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.05)
+            named = asyncio.create_task(block(0.3), name="relay")
+            unnamed = asyncio.create_task(asyncio.sleep(0))
+            await asyncio.gather(named, unnamed)
+            await asyncio.sleep(0.1)
+        finally:
+            await monitor.stop()
+        return monitor, named.get_name(), unnamed.get_name()
+
+    monitor, named, unnamed = asyncio.run(main())
+    assert named == "relay"
+    assert unnamed.startswith("Task-")
+    assert monitor.top_offenders()[0]["task"] == "relay"
+
+
+def test_stop_restores_task_factory():
+    async def main():
+        monitor = LoopLagMonitor()
+        monitor.start()
+        await monitor.stop()
+        return asyncio.get_running_loop().get_task_factory()
+
+    assert asyncio.run(main()) is None
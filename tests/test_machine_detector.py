@@ -0,0 +1,72 @@
+import math
+import audioop
+
+from services.amd.machine_detector import MachineDetector, HUMAN, MACHINE, UNKNOWN
+
+FRAME_BYTES = 160
+
+
+def speech(ms: int) -> bytes:
+    """300Hz tone at speaking level, as μ-law."""
+    pcm = b''.join(
+        int(8000 * math.sin(2 * math.pi * 300 * i / 8000)).to_bytes(2, 'little', signed=True)
+        for i in range(8 * ms)
+    )
+    return audioop.lin2ulaw(pcm, 2)
+
+
+def silence(ms: int) -> bytes:
+    return audioop.lin2ulaw(b'\x00\x00' * 8 * ms, 2)
+
+
+def classify(audio: bytes, detector: MachineDetector = None):
+    """Feed audio in Twilio-sized messages; return (verdict, ms of audio it took)."""
+    detector = detector or MachineDetector()
+    for i in range(0, len(audio), FRAME_BYTES):
+        verdict = detector.feed(audio[i:i + FRAME_BYTES])
+        if verdict:
+            return verdict, detector.elapsed_ms
+    return None, detector.elapsed_ms
+
+
+def test_short_hello_then_silence_is_human():
+    verdict, elapsed = classify(speech(600) + silence(1000))
+    assert verdict == HUMAN
+    assert elapsed == 1400
+
+
+def test_repeated_hellos_with_short_pauses_are_human():
+    # People repeat themselves while the bot stays silent waiting for a verdict
+    audio = speech(900) + silence(600) + speech(900) + silence(600) + speech(1200) + silence(1000)
+    verdict, _ = classify(audio)
+    assert verdict == HUMAN
+
+
+def test_long_greeting_is_machine():
+    audio = speech(1200) + silence(200) + speech(2000) + silence(2000)
+    verdict, elapsed = classify(audio)
+    assert verdict == MACHINE
+    assert elapsed < 3500
+
+
+def test_silence_is_unknown():
+    verdict, elapsed = classify(silence(6000))
+    assert verdict == UNKNOWN
+    assert elapsed == 5000
+
+
+def test_greeting_end_detected_after_machine_verdict():
+    detector = MachineDetector()
+    assert classify(speech(3000), detector)[0] == MACHINE
+    assert not detector.greeting_ended
+
+    detector.feed(silence(1200))
+    assert detector.greeting_ended
+
+
+def test_partial_frames_are_buffered():
+    detector = MachineDetector()
+    audio = speech(600) + silence(1000)
+    for i in range(0, len(audio), 100):
+        detector.feed(audio[i:i + 100])
+    assert detector.verdict == HUMAN